@@ -0,0 +1,33 @@
+"""
+===============
+Array backends
+===============
+This module selects the array module, its linear algebra module and
+the conversion to numpy-array for CPU (numpy) or GPU (cupy) calculation.
+cupy is imported only when GPU is requested.
+"""
+
+import numpy as np
+import scipy.linalg
+
+
+def load_backend(use_gpu = False):
+    """Load array backend
+
+    Args:
+        use_gpu {bool}
+            wheather use gpu and cupy.
+            if True, you need install package `cupy`.
+
+    Returns:
+        xp {module} : array module, `numpy` or `cupy`
+        xpxl {module} : linear algebra module,
+            `scipy.linalg` or `cupyx.scipy.linalg`
+        asnumpy {function} : convert array of xp to numpy-array
+    """
+    if use_gpu:
+        import cupy
+        import cupyx.scipy.linalg
+        return cupy, cupyx.scipy.linalg, cupy.asnumpy
+    else:
+        return np, scipy.linalg, np.asarray
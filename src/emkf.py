@@ -9,10 +9,294 @@ for Linear-Gaussian state space models
 import math
 
 import numpy as np
+from numba import njit
 
+from backend import load_backend
 from utils import array1d, array2d
-from util_functions import _parse_observations, _last_dims, \
-    _determine_dimensionality
+from util_functions import _parse_observations, _determine_dimensionality, \
+    _broadcast_time_axis
+
+
+@njit(cache = True, fastmath = True)
+def _cho_solve(L, B, X):
+    """Solve :math:`L L^T X = B` into `X` by forward and back substitution.
+
+    Args:
+        L [n_dim, n_dim] {numpy-array, float} : lower Cholesky factor
+        B [n_dim, n_col] {numpy-array, float} : right hand side
+        X [n_dim, n_col] {numpy-array, float} : output, may be same as B
+    """
+    n, n_col = B.shape
+    X[...] = B
+    for i in range(n):
+        for j in range(i):
+            for k in range(n_col):
+                X[i, k] -= L[i, j] * X[j, k]
+        for k in range(n_col):
+            X[i, k] /= L[i, i]
+    for i in range(n - 1, -1, -1):
+        for j in range(i + 1, n):
+            for k in range(n_col):
+                X[i, k] -= L[j, i] * X[j, k]
+        for k in range(n_col):
+            X[i, k] /= L[i, i]
+    return X
+
+
+@njit(cache = True, fastmath = True)
+def _solve_sym(S, B, X, invert):
+    """Solve :math:`S X = B` into `X` for symmetric `S`.
+
+    Args:
+        S [n_dim, n_dim] {numpy-array, float} : symmetric coefficient matrix
+        B [n_dim, n_col] {numpy-array, float} : right hand side
+        X [n_dim, n_col] {numpy-array, float} : output
+        invert {str} : "cholesky", "lstsq" or "pinv"
+    """
+    if invert == "cholesky":
+        _cho_solve(np.linalg.cholesky(S), B, X)
+    elif invert == "lstsq":
+        X[...] = np.linalg.lstsq(S, B)[0]
+    else:
+        X[...] = np.dot(np.linalg.pinv(S), B)
+    return X
+
+
+@njit(cache = True, fastmath = True)
+def _soft_update(X, X_est, eta, cutoff):
+    """Move `X` toward `X_est` by `eta` times their clipped difference in place.
+
+    Args:
+        X {numpy-array, float} : parameter to be updated
+        X_est {numpy-array, float} : estimation of X, same shape as X
+        eta {float} : update rate
+        cutoff {float} : cutoff distance of the difference
+    """
+    for i in np.ndindex(X.shape):
+        diff = X[i] - X_est[i]
+        if diff > cutoff:
+            diff = cutoff
+        elif diff < -cutoff:
+            diff = -cutoff
+        X[i] -= eta * diff
+
+
+@njit(cache = True, fastmath = True)
+def _kf_predict_step(F, Q, b, x, V, x_pred, V_pred, Fx, FV, FVF):
+    """Calculate predicted distribution into `x_pred`, `V_pred` in place.
+    Inputs are in the calculation dtype, outputs may be in another one.
+
+    Args:
+        F [n_dim_sys, n_dim_sys] {numpy-array, float} : transition matrix
+        Q [n_dim_sys, n_dim_sys] {numpy-array, float} : transition covariance
+        b [n_dim_sys] {numpy-array, float} : transition offset
+        x [n_dim_sys] {numpy-array, float} : filtered mean for previous time
+        V [n_dim_sys, n_dim_sys] {numpy-array, float}
+            : filtered covariance for previous time
+        x_pred [n_dim_sys] {numpy-array, float} : predicted mean to write
+        V_pred [n_dim_sys, n_dim_sys] {numpy-array, float}
+            : predicted covariance to write
+        Fx [n_dim_sys] {numpy-array, float} : scratch buffer
+        FV, FVF [n_dim_sys, n_dim_sys] {numpy-array, float} : scratch buffers
+    """
+    np.dot(F, x, Fx)
+    np.dot(F, V, FV)
+    np.dot(FV, F.T, FVF)
+    for i in range(x.shape[0]):
+        x_pred[i] = Fx[i] + b[i]
+        for j in range(x.shape[0]):
+            # remove asymmetry caused by round-off
+            V_pred[i, j] = 0.5 * ((FVF[i, j] + Q[i, j]) + (FVF[j, i] + Q[j, i]))
+
+
+@njit(cache = True, fastmath = True)
+def _kf_filter_step(H, R, d, y, x, V, x_filt, V_filt, joseph, invert,
+                    HV, S, KT, e, Ke, KR, W1, W2, IKH):
+    """Calculate filtered distribution into `x_filt`, `V_filt` in place.
+    Inputs are in the calculation dtype, outputs may be in another one.
+
+    Args:
+        H [n_dim_obs, n_dim_sys] {numpy-array, float} : observation matrix
+        R [n_dim_obs, n_dim_obs] {numpy-array, float} : observation covariance
+        d [n_dim_obs] {numpy-array, float}
+            : observation offset. if None, `y` is already offset
+        y [n_dim_obs] {numpy-array, float} : observation
+        x [n_dim_sys] {numpy-array, float} : predicted mean
+        V [n_dim_sys, n_dim_sys] {numpy-array, float} : predicted covariance
+        x_filt [n_dim_sys] {numpy-array, float} : filtered mean to write
+        V_filt [n_dim_sys, n_dim_sys] {numpy-array, float}
+            : filtered covariance to write
+        joseph {bool} : if True, update covariance by Joseph form
+        invert {str} : method to solve for Kalman gain
+        HV, KT [n_dim_obs, n_dim_sys] {numpy-array, float} : scratch buffers
+        S [n_dim_obs, n_dim_obs] {numpy-array, float} : scratch buffer
+        e [n_dim_obs] {numpy-array, float} : scratch buffer
+        Ke [n_dim_sys] {numpy-array, float} : scratch buffer
+        KR [n_dim_sys, n_dim_obs] {numpy-array, float} : scratch buffer
+        W1, W2, IKH [n_dim_sys, n_dim_sys] {numpy-array, float}
+            : scratch buffers
+    """
+    n_dim_sys = x.shape[0]
+
+    # K^T = S^{-1} H V for innovation covariance S
+    np.dot(H, V, HV)
+    np.dot(HV, H.T, S)
+    S += R
+    _solve_sym(S, HV, KT, invert)
+    K = KT.T
+
+    # innovation e = y - (H x + d), the branch is resolved at compile time
+    np.dot(H, x, e)
+    if d is None:
+        for k in range(e.shape[0]):
+            e[k] = y[k] - e[k]
+    else:
+        for k in range(e.shape[0]):
+            e[k] = y[k] - (e[k] + d[k])
+    np.dot(e, KT, Ke)
+    for i in range(n_dim_sys):
+        x_filt[i] = x[i] + Ke[i]
+
+    if joseph:
+        # (I-KH) V (I-KH)^T + K R K^T into W2
+        np.dot(K, H, IKH)
+        for i in range(n_dim_sys):
+            for j in range(n_dim_sys):
+                IKH[i, j] = -IKH[i, j]
+            IKH[i, i] += 1
+        np.dot(IKH, V, W1)
+        np.dot(W1, IKH.T, W2)
+        np.dot(K, R, KR)
+        np.dot(KR, KT, W1)
+        for i in range(n_dim_sys):
+            for j in range(n_dim_sys):
+                V_filt[i, j] = 0.5 * ((W2[i, j] + W1[i, j]) + (W2[j, i] + W1[j, i]))
+    else:
+        np.dot(K, HV, W1)
+        for i in range(n_dim_sys):
+            for j in range(n_dim_sys):
+                V_filt[i, j] = 0.5 * ((V[i, j] - W1[i, j]) + (V[j, i] - W1[j, i]))
+
+
+@njit(cache = True, fastmath = True)
+def _kf_backward_step(A, x_filt, V_filt, x_pred, V_pred, x_smooth_next,
+                    V_smooth_next, x_smooth, V_smooth, V_pair, dx, Adx, D, AD, ADA):
+    """Calculate RTS-smoothed distribution for time t into `x_smooth`,
+    `V_smooth` and pairwise covariance for time t+1 into `V_pair` in place.
+    Inputs are in the calculation dtype, outputs may be in another one.
+
+    Args:
+        A [n_dim_sys, n_dim_sys] {numpy-array, float}
+            : fixed interval smoothing gain for time t
+        x_filt, V_filt {numpy-array, float} : filtered values for time t
+        x_pred, V_pred {numpy-array, float} : predicted values for time t+1
+        x_smooth_next, V_smooth_next {numpy-array, float}
+            : smoothed values for time t+1
+        dx, Adx [n_dim_sys] {numpy-array, float} : scratch buffers
+        D, AD, ADA [n_dim_sys, n_dim_sys] {numpy-array, float}
+            : scratch buffers
+    """
+    n_dim_sys = x_filt.shape[0]
+
+    # fixed interval smoothing
+    for i in range(n_dim_sys):
+        dx[i] = x_smooth_next[i] - x_pred[i]
+    np.dot(A, dx, Adx)
+    for i in range(n_dim_sys):
+        x_smooth[i] = x_filt[i] + Adx[i]
+
+    for i in range(n_dim_sys):
+        for j in range(n_dim_sys):
+            D[i, j] = V_smooth_next[i, j] - V_pred[i, j]
+    np.dot(A, D, AD)
+    np.dot(AD, A.T, ADA)
+    for i in range(n_dim_sys):
+        for j in range(n_dim_sys):
+            V_smooth[i, j] = 0.5 * ((V_filt[i, j] + ADA[i, j])
+                + (V_filt[j, i] + ADA[j, i]))
+
+    # calculate pairwise covariance
+    np.dot(V_smooth_next, A.T, AD)
+    V_pair[...] = AD
+
+
+_jax_scans = None
+
+
+def _get_jax_scans():
+    """Build filter and RTS-smoother scans with JAX.
+    JAX is imported here so that it is only required with `use_jax`.
+
+    Returns:
+        filter_scan {function}
+            : (x_filt, V_filt, F, Q, b, H, R, d, y, joseph, invert)
+            -> (x_pred, V_pred, x_filt, V_filt)
+            for a block of times, where the initial x_filt, V_filt are for
+            the time before the block
+        backward_scan {function}
+            : (x_smooth, V_smooth, F, x_filt, V_filt, x_pred, V_pred, invert)
+            -> (x_smooth, V_smooth, V_pair) for a block of times in reverse,
+            where the initial x_smooth, V_smooth are for the time after the block
+    """
+    global _jax_scans
+    if _jax_scans is None:
+        import functools
+        import jax
+        import jax.numpy as jnp
+        import jax.scipy.linalg as jsl
+
+        def solve(S, B, invert):
+            if invert == "cholesky":
+                return jsl.cho_solve(jsl.cho_factor(S, lower = True), B)
+            elif invert == "lstsq":
+                return jnp.linalg.lstsq(S, B)[0]
+            return jnp.linalg.pinv(S) @ B
+
+        def filter_step(carry, inputs, joseph, invert):
+            x_filt, V_filt = carry
+            F, Q, b, H, R, d, y = inputs
+            x_pred = F @ x_filt + b
+            V_pred = F @ V_filt @ F.T + Q
+            V_pred = 0.5 * (V_pred + V_pred.T)
+            HV = H @ V_pred
+            K = solve(HV @ H.T + R, HV, invert).T
+            x_filt = x_pred + K @ (y - (H @ x_pred + d))
+            if joseph:
+                IKH = jnp.eye(K.shape[0], dtype = K.dtype) - K @ H
+                V_filt = IKH @ V_pred @ IKH.T + K @ R @ K.T
+            else:
+                V_filt = V_pred - K @ HV
+            V_filt = 0.5 * (V_filt + V_filt.T)
+            return (x_filt, V_filt), (x_pred, V_pred, x_filt, V_filt)
+
+        def backward_step(carry, inputs, invert):
+            x_smooth, V_smooth = carry
+            F, x_filt, V_filt, x_pred, V_pred = inputs
+            if invert == "cholesky":
+                A = jnp.linalg.solve(V_pred.T, (V_filt @ F).T).T
+            else:
+                A = solve(V_pred, (V_filt @ F).T, invert).T
+            V_pair = V_smooth @ A.T
+            x_smooth = x_filt + A @ (x_smooth - x_pred)
+            V_smooth = V_filt + A @ (V_smooth - V_pred) @ A.T
+            V_smooth = 0.5 * (V_smooth + V_smooth.T)
+            return (x_smooth, V_smooth), (x_smooth, V_smooth, V_pair)
+
+        @functools.partial(jax.jit, static_argnames = ("joseph", "invert"))
+        def filter_scan(x_filt, V_filt, F, Q, b, H, R, d, y, joseph = False,
+                        invert = "cholesky"):
+            return jax.lax.scan(functools.partial(filter_step, joseph = joseph,
+                invert = invert), (x_filt, V_filt), (F, Q, b, H, R, d, y))[1]
+
+        @functools.partial(jax.jit, static_argnames = "invert")
+        def backward_scan(x_smooth, V_smooth, F, x_filt, V_filt, x_pred, V_pred,
+                        invert = "cholesky"):
+            return jax.lax.scan(functools.partial(backward_step, invert = invert),
+                (x_smooth, V_smooth), (F, x_filt, V_filt, x_pred, V_pred),
+                reverse = True)[1]
+
+        _jax_scans = (filter_scan, backward_scan)
+    return _jax_scans
 
 
 class ExpectationMaximizationKalmanFilter(object) :
@@ -67,20 +351,52 @@ class ExpectationMaximizationKalmanFilter(object) :
             'initial_covariance']
         iteration {int}
             : number of iterations for EM algorithm
+        em_tol {float}
+            : opt-in tolerance for convergence of EM algorithm in "smooth"
+            mode. iterations for an interval stop when the estimation of F
+            changes less than `em_tol` in relative and absolute terms
+            and "b" is not in `em_vars`. since EM converges only linearly,
+            a loose tolerance is needed to stop early in practice.
+            if None (default), always iterate `iteration` times
         mode {str}
             : update mode of EMKF
             "smooth": normal mode, using smoothed value while caluculating M-step
             "filter": substituting filtered for smoothed while calculating M-step
+        joseph_form {bool}
+            : if True, update filtered covariance by Joseph form
+            (I-KH)V(I-KH)^T + KRK^T, which keeps it symmetric and
+            positive semi-definite at some more cost
+        invert {str}
+            : method to solve linear systems for Kalman gain and
+            fixed interval smoothing gain
+            "cholesky": Cholesky solve for Kalman gain and LU solve for
+                smoothing gain, assuming positive definite covariances
+            "lstsq": least squares solve, handling rank deficiency
+            "pinv": multiplying Moore-Penrose pseudo inverse by SVD
         n_dim_sys {int}
             : dimension of system transition variable
         n_dim_obs {int}
             : dimension of observation variable
         dtype {type}
             : data type of numpy-array
+        store_dtype {type}
+            : data type of stored trajectories x_pred, V_pred, x_filt, V_filt,
+            x_smooth, V_smooth and V_pair. calculation of each step is done by
+            `dtype` and results are cast when stored, so that e.g. float32
+            halves memory of the trajectories with float64 calculation.
+            float32 or float64, not more precise than `dtype`.
+            if None, same as `dtype`
         use_gpu {bool}
             wheather use gpu and cupy.
             if True, you need install package `cupy`.
             if False, set `numpy` for calculation.
+        use_jax {bool}
+            wheather run the filter and smoother sweeps by `jax.lax.scan`.
+            if True, you need install package `jax`.
+            results are stored in numpy-array. for float64 calculation,
+            enable `jax_enable_x64` of jax config.
+        verbose {bool}
+            : if True, print progress once per update interval
 
     Attributes:
         y : `observation`
@@ -96,20 +412,20 @@ class ExpectationMaximizationKalmanFilter(object) :
                 transition_covariance = None, observation_covariance = None,
                 transition_offsets = None, observation_offsets = None,
                 update_interval = 1, eta = 0.1, cutoff = 0.1, etab = 0.1, cutoffb=0.1,
-                iteration = 1,
+                iteration = 1, em_tol = None,
                 store_transition_matrices_on = True,
                 em_vars = ["F"],
-                mode = "smooth",
+                mode = "smooth", joseph_form = False, invert = "cholesky",
                 n_dim_sys = None, n_dim_obs = None, dtype = "float32",
-                use_gpu = False):
+                store_dtype = None, use_gpu = False, use_jax = False,
+                verbose = False):
         """Setup initial parameters.
         """
+        if use_gpu and use_jax:
+            raise ValueError("You can select either \"use_gpu\" or \"use_jax\".")
         self.use_gpu = use_gpu
-        if use_gpu:
-            import cupy
-            self.xp = cupy
-        else:
-            self.xp = np
+        self.use_jax = use_jax
+        self.xp, self.xpxl, self._asnumpy = load_backend(use_gpu)
 
         # determine dimensionality
         self.n_dim_sys = _determine_dimensionality(
@@ -126,47 +442,51 @@ class ExpectationMaximizationKalmanFilter(object) :
             n_dim_obs
         )
 
-        self.y = self.xp.asarray(observation)
+        # cupy.asarray already returns C-contiguous array on device
+        if self.use_gpu:
+            self.y = self.xp.asarray(observation, dtype = dtype)
+        else:
+            self.y = np.ascontiguousarray(observation, dtype = dtype)
 
         if initial_mean is None:
             self.initial_mean = self.xp.zeros(self.n_dim_sys, dtype = dtype)
         else:
-            self.initial_mean = initial_mean.astype(dtype)
+            self.initial_mean = self.xp.array(initial_mean, dtype = dtype)
         
         if initial_covariance is None:
             self.initial_covariance = self.xp.eye(self.n_dim_sys, dtype = dtype)
         else:
-            self.initial_covariance = initial_covariance.astype(dtype)
+            self.initial_covariance = self.xp.array(initial_covariance, dtype = dtype)
 
         if transition_matrices is None:
             self.F = self.xp.eye(self.n_dim_sys, dtype = dtype)
         else:
-            self.F = transition_matrices.astype(dtype)
+            self.F = self.xp.array(transition_matrices, dtype = dtype)
 
         if transition_covariance is not None:
-            self.Q = transition_covariance.astype(dtype)
+            self.Q = self.xp.array(transition_covariance, dtype = dtype)
         else:
             self.Q = self.xp.eye(self.n_dim_sys, dtype = dtype)
 
         if observation_matrices is None:
             self.H = self.xp.eye(self.n_dim_obs, self.n_dim_sys, dtype = dtype)
         else:
-            self.H = observation_matrices.astype(dtype)
+            self.H = self.xp.array(observation_matrices, dtype = dtype)
         
         if observation_covariance is None:
             self.R = self.xp.eye(self.n_dim_obs, dtype = dtype)
         else:
-            self.R = observation_covariance.astype(dtype)
+            self.R = self.xp.array(observation_covariance, dtype = dtype)
 
         if transition_offsets is None :
             self.b = self.xp.zeros(self.n_dim_sys, dtype = dtype)
         else :
-            self.b = transition_offsets.astype(dtype)
+            self.b = self.xp.array(transition_offsets, dtype = dtype)
 
         if observation_offsets is None :
             self.d = self.xp.zeros(self.n_dim_obs, dtype = dtype)
         else :
-            self.d = observation_offsets.astype(dtype)
+            self.d = self.xp.array(observation_offsets, dtype = dtype)
 
         if mode in ["filter", "smooth"]:
             self.mode = mode
@@ -174,13 +494,20 @@ class ExpectationMaximizationKalmanFilter(object) :
             raise ValueError("Your choice \"{}\" is mistaken. " 
                             + "You can only select \"filter\" or \"smooth\" mode.")
 
+        if invert in ["cholesky", "lstsq", "pinv"]:
+            self.invert = invert
+        else:
+            raise ValueError("Your choice \"{}\" is mistaken. ".format(invert)
+                            + "You can only select \"cholesky\", \"lstsq\" "
+                            + "or \"pinv\" for invert.")
+
 
         self.tau = int(update_interval)
         self.store_transition_matrices_on = store_transition_matrices_on
 
         if store_transition_matrices_on:
             self.Fs = self.xp.zeros(((len(self.y)-1)//self.tau+1+1,
-                                self.F.shape[0], self.F.shape[1]))
+                                self.F.shape[0], self.F.shape[1]), dtype = dtype)
             self.Fs[0] = self.F
 
         self.em_vars = []
@@ -190,11 +517,24 @@ class ExpectationMaximizationKalmanFilter(object) :
             self.em_vars.append("b")
 
         self.iteration = iteration
+        self.em_tol = em_tol
         self.eta = eta
         self.cutoff = cutoff
         self.etab = etab
         self.cutoffb = cutoffb
+        self.joseph_form = joseph_form
         self.dtype = dtype
+        if store_dtype is None:
+            self.store_dtype = dtype
+        elif store_dtype not in ["float32", "float64", np.float32, np.float64]:
+            raise ValueError("Your choice \"{}\" is mistaken. ".format(store_dtype)
+                            + "You can only select float32 or float64 for store_dtype.")
+        elif np.dtype(store_dtype).itemsize > np.dtype(dtype).itemsize:
+            raise ValueError("store_dtype \"{}\" must not be more precise ".format(store_dtype)
+                            + "than dtype \"{}\".".format(dtype))
+        else:
+            self.store_dtype = store_dtype
+        self.verbose = verbose
 
 
     def forward(self):
@@ -226,21 +566,37 @@ class ExpectationMaximizationKalmanFilter(object) :
         """
 
         T = self.y.shape[0]
-        self.x_pred = self.xp.zeros((T, self.n_dim_sys), dtype = self.dtype)
+        self.x_pred = self.xp.zeros((T, self.n_dim_sys), dtype = self.store_dtype)
         self.V_pred = self.xp.zeros((T, self.n_dim_sys, self.n_dim_sys),
-             dtype = self.dtype)
-        self.x_filt = self.xp.zeros((T, self.n_dim_sys), dtype = self.dtype)
+             dtype = self.store_dtype)
+        self.x_filt = self.xp.zeros((T, self.n_dim_sys), dtype = self.store_dtype)
         self.V_filt = self.xp.zeros((T, self.n_dim_sys, self.n_dim_sys),
-             dtype = self.dtype)
-        self.x_smooth = self.xp.zeros((T, self.n_dim_sys), dtype = self.dtype)
+             dtype = self.store_dtype)
+        self.x_smooth = self.xp.zeros((T, self.n_dim_sys), dtype = self.store_dtype)
         self.V_smooth = self.xp.zeros((T, self.n_dim_sys, self.n_dim_sys),
-             dtype = self.dtype)
+             dtype = self.store_dtype)
         self.V_pair = self.xp.zeros((T, self.n_dim_sys, self.n_dim_sys),
-             dtype = self.dtype)
+             dtype = self.store_dtype)
+
+        # broadcast time-invariant parameters along time axis
+        self._broadcast_parameters(T)
+
+        # scratch buffers reused by predict, filter and backward steps of every time
+        n, m = self.n_dim_sys, self.n_dim_obs
+        self._x_buf = self.xp.empty(n, dtype = self.dtype)
+        self._dx_buf = self.xp.empty(n, dtype = self.dtype)
+        self._e_buf = self.xp.empty(m, dtype = self.dtype)
+        self._FV_buf = self.xp.empty((n, n), dtype = self.dtype)
+        self._V_buf = self.xp.empty((n, n), dtype = self.dtype)
+        self._W_buf = self.xp.empty((n, n), dtype = self.dtype)
+        self._HV_buf = self.xp.empty((m, n), dtype = self.dtype)
+        self._S_buf = self.xp.empty((m, m), dtype = self.dtype)
+        self._KT_buf = self.xp.empty((m, n), dtype = self.dtype)
+        self._KR_buf = self.xp.empty((n, m), dtype = self.dtype)
 
         # initial setting
-        self.x_pred[0] = self.initial_mean.copy()
-        self.V_pred[0] = self.initial_covariance.copy()
+        self.x_pred[0] = self.initial_mean
+        self.V_pred[0] = self.initial_covariance
 
 
         # calculate prediction and filter for every time
@@ -254,35 +610,134 @@ class ExpectationMaximizationKalmanFilter(object) :
 
                 for n in range(self.iteration):
                     if n!=0:
-                        self.x_pred[s] = self.x_smooth[s].copy()
+                        self.x_pred[s] = self.x_smooth[s]
                         self.V_pred[s] = self.V_smooth[s] \
-                                    - self.xp.outer(self.x_smooth[s], self.x_smooth[s])
-                    for t in range(s+1, min(s + self.tau + 1, T)):
-                        # visualize calculating time
-                        print("\r filter calculating... t={}".format(t) + "/" + str(T), end="")
-                        self._predict_update(t, F_est)
-                        self._filter_update(t)
-                    F_est = self._update_transition_matrix(t, len(range(s, min(s + self.tau + 1, T))) - 1, F_est)
+                                    - self.x_smooth[s, :, None] @ self.x_smooth[s, None, :]
+                        # sweep and M-step only depend on F_est and fixed
+                        # x_filt[s], V_filt[s] unless b is updated, so stop
+                        # once F_est has converged
+                        if self.em_tol is not None and "b" not in self.em_vars \
+                                and self.xp.allclose(F_est, F_prev,
+                                    rtol = self.em_tol, atol = self.em_tol):
+                            break
+                    # last time of this interval
+                    t = min(s + self.tau, T - 1)
+                    self._sweep(s + 1, t + 1, F_est)
+                    F_prev = F_est
+                    F_est = self._update_transition_matrix(t, t - s, F_est)
 
                 # update transition matrix
-                self.F = self.F - self.eta * self.xp.minimum(self.xp.maximum(-self.cutoff, self.F - F_est),
-                                                            self.cutoff)
+                self._update_parameter(self.F, F_est, self.eta, self.cutoff)
                 if self.store_transition_matrices_on:
                     self.Fs[s//self.tau+1] = self.F
+
+                # visualize calculating time
+                if self.verbose:
+                    print("\r filter calculating... t={}".format(min(s + self.tau, T - 1))
+                        + "/" + str(T), end="")
         elif self.mode=="filter":
             self._filter_update(0)
 
-            for t in range(1, T):
-                print("\r filter calculating... t={}".format(t) + "/" + str(T), end="")
-                if (t-1)%self.tau == 0 and t < T-self.tau:
-                    for s in range(t, t+self.tau+1):
-                        self._predict_update(s)
-                        self._filter_update(s)
+            # scratch arrays for look-ahead, index i corresponds to time t-1+i
+            self._x_pred_ahead = self.xp.zeros((self.tau + 2, self.n_dim_sys),
+                dtype = self.dtype)
+            self._V_pred_ahead = self.xp.zeros((self.tau + 2, self.n_dim_sys,
+                self.n_dim_sys), dtype = self.dtype)
+            self._x_filt_ahead = self.xp.zeros((self.tau + 2, self.n_dim_sys),
+                dtype = self.dtype)
+            self._V_filt_ahead = self.xp.zeros((self.tau + 2, self.n_dim_sys,
+                self.n_dim_sys), dtype = self.dtype)
+            self._yd_ahead = self.xp.zeros((self.tau + 1, self.n_dim_obs),
+                dtype = self.dtype)
+
+            for t in range(1, T, self.tau):
+                if t < T-self.tau:
+                    self._look_ahead(t)
                     self._update_transition_matrix_approximately(t)
-                self._predict_update(t)
+                self._sweep(t, min(t + self.tau, T))
+
+                # visualize calculating time
+                if self.verbose:
+                    print("\r filter calculating... t={}".format(min(t + self.tau, T) - 1)
+                        + "/" + str(T), end="")
+
+
+
+    def _broadcast_parameters(self, T):
+        """Broadcast parameters to arrays indexable by time
+
+        Args:
+            T {int} : length of data y
+        """
+        self._F3 = _broadcast_time_axis(self.F, T, 2, self.use_gpu)
+        self._Q3 = _broadcast_time_axis(self.Q, T, 2, self.use_gpu)
+        self._b2 = _broadcast_time_axis(self.b, T, 1, self.use_gpu)
+        self._H3 = _broadcast_time_axis(self.H, T, 2, self.use_gpu)
+        self._R3 = _broadcast_time_axis(self.R, T, 2, self.use_gpu)
+        self._d2 = _broadcast_time_axis(self.d, T, 1, self.use_gpu)
+
+
+    def _update_parameter(self, X, X_est, eta, cutoff):
+        """Update parameter toward its estimation in place.
+        In-place update keeps the time-broadcast views of X up to date.
+
+        Args:
+            X {numpy-array, float} : parameter, `self.F` or `self.b`
+            X_est {numpy-array, float} : estimation of X
+            eta {float} : update rate
+            cutoff {float} : cutoff distance of the difference
+        """
+        X_est = self.xp.broadcast_to(X_est, X.shape)
+        if self.use_gpu:
+            X -= eta * self.xp.clip(X - X_est, -cutoff, cutoff)
+        else:
+            _soft_update(X, X_est, eta, cutoff)
+
+
+    def _sweep(self, start, stop, F=None):
+        """Calculate prediction and filter for times [start, stop)
+
+        Args:
+            start {int} : first time of sweep
+            stop {int} : end time of sweep, not included
+            F [n_dim_sys, n_dim_sys] {numpy-array, float}
+                : transition matrix. if None, use `self.F`
+        """
+        if self.use_jax:
+            self._jax_sweep(start, stop, F, self.x_pred[start:stop],
+                self.V_pred[start:stop], self.x_filt[start:stop],
+                self.V_filt[start:stop])
+        else:
+            for t in range(start, stop):
+                self._predict_update(t, F)
                 self._filter_update(t)
 
 
+    def _jax_sweep(self, start, stop, F, x_pred, V_pred, x_filt, V_filt):
+        """Calculate prediction and filter for times [start, stop)
+        by `jax.lax.scan` and write them into given arrays
+
+        Args:
+            start {int} : first time of sweep
+            stop {int} : end time of sweep, not included
+            F [n_dim_sys, n_dim_sys] {numpy-array, float}
+                : transition matrix. if None, use `self.F`
+            x_pred, V_pred, x_filt, V_filt {numpy-array, float}
+                : arrays of length `stop - start` to write results
+        """
+        filter_scan, _ = _get_jax_scans()
+        if F is None:
+            F = self._F3[start - 1:stop - 1]
+        else:
+            F = np.broadcast_to(F, (stop - start,) + F.shape)
+        results = filter_scan(self.x_filt[start - 1].astype(self.dtype, copy = False),
+            self.V_filt[start - 1].astype(self.dtype, copy = False),
+            F, self._Q3[start - 1:stop - 1], self._b2[start - 1:stop - 1],
+            self._H3[start:stop], self._R3[start:stop], self._d2[start:stop],
+            self.y[start:stop], joseph = self.joseph_form, invert = self.invert)
+        for array, result in zip((x_pred, V_pred, x_filt, V_filt), results):
+            array[...] = np.asarray(result)
+
 
     def _predict_update(self, t, F=None):
         """Calculate fileter update
@@ -292,13 +747,34 @@ class ExpectationMaximizationKalmanFilter(object) :
         """
         # extract parameters for time t-1
         if F is None:
-            F = _last_dims(self.F, t - 1, 2)
-        Q = _last_dims(self.Q, t - 1, 2)
-        b = _last_dims(self.b, t - 1, 1)
+            F = self._F3[t - 1]
 
         # calculate predicted distribution for time t
-        self.x_pred[t] = F @ self.x_filt[t-1] + b
-        self.V_pred[t] = F @ self.V_filt[t-1] @ F.T + Q
+        self._predict_step(t, F, self._Q3[t-1], self._b2[t-1],
+            self.x_filt, self.V_filt, self.x_pred, self.V_pred)
+
+
+    def _predict_step(self, i, F, Q, b, x_filt, V_filt, x_pred, V_pred):
+        """Calculate predicted distribution into `x_pred[i]`, `V_pred[i]`
+        from `x_filt[i-1]`, `V_filt[i-1]`
+
+        Args:
+            i {int} : index of arrays to write
+            F, Q, b {numpy-array, float} : parameters for the time of index i-1
+        """
+        if self.use_gpu:
+            x = self.xp.matmul(F, x_filt[i-1], out = self._x_buf)
+            x += b
+            x_pred[i] = x
+            FV = self.xp.matmul(F, V_filt[i-1], out = self._FV_buf)
+            V = self.xp.matmul(FV, F.T, out = self._V_buf)
+            V += Q
+            V_pred[i] = self._symmetrize(V)
+        else:
+            # cast stored values only when they are not in calculation dtype
+            _kf_predict_step(F, Q, b, x_filt[i-1].astype(self.dtype, copy = False),
+                V_filt[i-1].astype(self.dtype, copy = False), x_pred[i], V_pred[i],
+                self._x_buf, self._FV_buf, self._V_buf)
 
 
     def _predict_update_pair(self, t, F=None):
@@ -309,9 +785,9 @@ class ExpectationMaximizationKalmanFilter(object) :
         """
         # extract parameters for time t-1
         if F is None:
-            F = _last_dims(self.F, t - 1, 2)
-        Q = _last_dims(self.Q, t - 1, 2)
-        b = _last_dims(self.b, t - 1, 1)
+            F = self._F3[t - 1]
+        Q = self._Q3[t - 1]
+        b = self._b2[t - 1]
 
         # calculate predicted distribution for time t
         self.x_pred[t] = F @ self.x_filt[t-1] + b
@@ -329,19 +805,129 @@ class ExpectationMaximizationKalmanFilter(object) :
             K [n_dim_sys, n_dim_obs] {numpy-array, float}
                 : Kalman gain matrix for time t
         """
-        # extract parameters for time t
-        H = _last_dims(self.H, t, 2)
-        R = _last_dims(self.R, t, 2)
-        d = _last_dims(self.d, t, 1)
-
         # calculate filter step
-        K = self.V_pred[t] @ (
-            H.T @ self.xp.linalg.pinv(H @ (self.V_pred[t] @ H.T) + R)
-            )
-        self.x_filt[t] = self.x_pred[t] + K @ (
-            self.y[t] - (H @ self.x_pred[t] + d)
-            )
-        self.V_filt[t] = self.V_pred[t] - K @ (H @ self.V_pred[t])
+        self._filter_step(t, self._H3[t], self._R3[t], self._d2[t], self.y[t],
+            self.x_pred, self.V_pred, self.x_filt, self.V_filt)
+
+
+    def _filter_step(self, i, H, R, d, y, x_pred, V_pred, x_filt, V_filt):
+        """Calculate filtered distribution into `x_filt[i]`, `V_filt[i]`
+        from `x_pred[i]`, `V_pred[i]`
+
+        Args:
+            i {int} : index of arrays to write
+            H, R, d {numpy-array, float} : parameters for the time of index i.
+                `d` may be None when `y` is already offset
+            y [n_dim_obs] {numpy-array, float} : observation for the time of index i
+        """
+        if self.use_gpu:
+            HV = self.xp.matmul(H, V_pred[i], out = self._HV_buf)
+            S = self.xp.matmul(HV, H.T, out = self._S_buf)
+            S += R
+            K = self._solve(S, HV).T
+
+            # innovation y - (H x + d)
+            e = self.xp.matmul(H, x_pred[i], out = self._e_buf)
+            if d is not None:
+                e += d
+            self.xp.subtract(y, e, out = e)
+            x = self.xp.matmul(K, e, out = self._x_buf)
+            x += x_pred[i]
+            x_filt[i] = x
+
+            if self.joseph_form:
+                IKH = self.xp.matmul(K, H, out = self._W_buf)
+                IKH *= -1
+                IKH.reshape(-1)[::self.n_dim_sys + 1] += 1
+                W = self.xp.matmul(IKH, V_pred[i], out = self._FV_buf)
+                V = self.xp.matmul(W, IKH.T, out = self._V_buf)
+                KR = self.xp.matmul(K, R, out = self._KR_buf)
+                V += self.xp.matmul(KR, K.T, out = self._FV_buf)
+            else:
+                W = self.xp.matmul(K, HV, out = self._FV_buf)
+                V = self.xp.subtract(V_pred[i], W, out = self._V_buf)
+            V_filt[i] = self._symmetrize(V)
+        else:
+            _kf_filter_step(H, R, d, y, x_pred[i].astype(self.dtype, copy = False),
+                V_pred[i].astype(self.dtype, copy = False), x_filt[i], V_filt[i],
+                self.joseph_form, self.invert, self._HV_buf, self._S_buf,
+                self._KT_buf, self._e_buf, self._x_buf, self._KR_buf,
+                self._FV_buf, self._V_buf, self._W_buf)
+
+
+    def _symmetrize(self, V):
+        """Remove asymmetry of `V` caused by round-off into a scratch buffer
+
+        Args:
+            V [n_dim_sys, n_dim_sys] {numpy-array, float}
+                : covariance, not `self._W_buf`
+
+        Returns:
+            (V + V^T) / 2 [n_dim_sys, n_dim_sys] {numpy-array, float}
+        """
+        W = self.xp.add(V, V.T, out = self._W_buf)
+        W *= 0.5
+        return W
+
+
+    def _solve(self, S, B):
+        """Solve :math:`S X = B` for symmetric `S` by `invert` method
+
+        Args:
+            S [(n_batch,) n_dim, n_dim] {numpy-array, float}
+                : symmetric coefficient matrices
+            B [(n_batch,) n_dim, n_col] {numpy-array, float}
+                : right hand side
+
+        Returns:
+            X [(n_batch,) n_dim, n_col] {numpy-array, float} : solution
+        """
+        if self.invert == "cholesky":
+            if S.ndim > 2:
+                return self.xp.linalg.solve(S, B)
+            L = self.xp.linalg.cholesky(S)
+            return self.xpxl.solve_triangular(L.T,
+                self.xpxl.solve_triangular(L, B, lower = True), lower = False)
+        elif self.invert == "lstsq":
+            if S.ndim > 2:
+                X = self.xp.empty(B.shape, dtype = self.dtype)
+                for i in range(len(S)):
+                    X[i] = self.xp.linalg.lstsq(S[i], B[i], rcond = None)[0]
+                return X
+            return self.xp.linalg.lstsq(S, B, rcond = None)[0]
+        else:
+            return self.xp.linalg.pinv(S) @ B
+
+
+    def _look_ahead(self, t):
+        """Calculate prediction and filter for times [t, t+tau] by current F
+        into scratch arrays, leaving the trajectory of this filter untouched.
+        Index i of scratch arrays corresponds to time t-1+i.
+
+        Args:
+            t {int} : first time of look-ahead
+        """
+        if self.use_jax:
+            self._jax_sweep(t, t + self.tau + 1, None,
+                self._x_pred_ahead[1:], self._V_pred_ahead[1:],
+                self._x_filt_ahead[1:], self._V_filt_ahead[1:])
+            return
+
+        # observations minus offsets for the block at once, so that
+        # each filter step only subtracts H x_pred
+        yd = self.xp.subtract(self.y[t:t + self.tau + 1],
+            self._d2[t:t + self.tau + 1], out = self._yd_ahead)
+
+        self._x_filt_ahead[0] = self.x_filt[t - 1]
+        self._V_filt_ahead[0] = self.V_filt[t - 1]
+        for i in range(1, self.tau + 2):
+            s = t - 1 + i
+            self._predict_step(i, self._F3[s-1], self._Q3[s-1], self._b2[s-1],
+                self._x_filt_ahead, self._V_filt_ahead,
+                self._x_pred_ahead, self._V_pred_ahead)
+            self._filter_step(i, self._H3[s], self._R3[s], None, yd[i - 1],
+                self._x_pred_ahead, self._V_pred_ahead,
+                self._x_filt_ahead, self._V_filt_ahead)
 
 
     def _filter_update_pair(self, t):
@@ -355,14 +941,12 @@ class ExpectationMaximizationKalmanFilter(object) :
                 : Kalman gain matrix for time t
         """
         # extract parameters for time t
-        H = _last_dims(self.H, t, 2)
-        R = _last_dims(self.R, t, 2)
-        d = _last_dims(self.d, t, 1)
+        H = self._H3[t]
+        R = self._R3[t]
+        d = self._d2[t]
 
         # calculate filter step
-        K = self.V_pred[t] @ (
-            H.T @ self.xp.linalg.pinv(H @ (self.V_pred[t] @ H.T) + R)
-            )
+        K = self._solve(H @ (self.V_pred[t] @ H.T) + R, H @ self.V_pred[t]).T
         self.x_filt[t] = self.x_pred[t] + K @ (
             self.y[t] - (H @ self.x_pred[t] + d)
             )
@@ -380,51 +964,48 @@ class ExpectationMaximizationKalmanFilter(object) :
         self._backward(s, tau, F)
 
         if "F" in self.em_vars:
-            res1 = self.xp.zeros((self.n_dim_sys, self.n_dim_sys), dtype = self.dtype)
-            res2 = self.xp.zeros((self.n_dim_sys, self.n_dim_sys), dtype = self.dtype)
-            for t in range(s - tau + 1, s + 1):
-                b = _last_dims(self.b, t - 1, 1)
-                res1 += self.V_pair[t] + self.xp.outer(
-                    self.x_smooth[t], self.x_smooth[t - 1]
-                    )
-                res1 -= self.xp.outer(b, self.x_smooth[t - 1])            
-                res2 += self.V_smooth[t - 1] \
-                    + self.xp.outer(self.x_smooth[t - 1], self.x_smooth[t - 1])
- 
+            # sum over t in [s-tau+1, s] as matrix products along time axis
+            xs = self.x_smooth[s - tau + 1:s + 1].astype(self.dtype, copy = False)
+            xs_prev = self.x_smooth[s - tau:s].astype(self.dtype, copy = False)
+            res1 = self.V_pair[s - tau + 1:s + 1].sum(axis = 0, dtype = self.dtype) \
+                + xs.T @ xs_prev - self._b2[s - tau:s].T @ xs_prev
+            res2 = self.V_smooth[s - tau:s].sum(axis = 0, dtype = self.dtype) \
+                + xs_prev.T @ xs_prev
+
             F_est = res1 @ self.xp.linalg.pinv(res2)
 
         if "b" in self.em_vars and tau > 1:
             b_est = self.xp.zeros(self.n_dim_sys, dtype = self.dtype)
 
             for t in range(s-tau+1, s):
-                F = _last_dims(self.F, t - 1)
+                F = self._F3[t - 1]
                 b_est += self.x_smooth[t] - F @ self.x_smooth[t - 1]
             b_est *= (1.0 / (tau - 1))
 
             # update transition offset
-            self.b = self.b - self.etab * self.xp.minimum(self.xp.maximum(-self.cutoffb, self.b - b_est),
-                                                        self.cutoffb)
+            self._update_parameter(self.b, b_est, self.etab, self.cutoffb)
 
         return F_est
 
 
     def _update_transition_matrix_approximately(self, t):
-        res1 = self.xp.zeros((self.n_dim_sys, self.n_dim_sys), dtype = self.dtype)
-        res2 = self.xp.zeros((self.n_dim_sys, self.n_dim_sys), dtype = self.dtype)
-        for s in range(t+1, t+self.tau+1):
-            b = _last_dims(self.b, s - 1, 1)
-            res1 += self.V_pair[s] + self.xp.outer(
-                self.x_filt[s], self.x_filt[s - 1]
-                )
-            res1 -= self.xp.outer(b, self.x_filt[s - 1])            
-            res2 += self.V_filt[s - 1] \
-                + self.xp.outer(self.x_filt[s - 1], self.x_filt[s - 1])
+        """Update state transition matrix by look-ahead filtered estimation.
+
+        Args:
+            t {int} : first time of look-ahead
+        """
+        # sum over s in [t+1, t+tau] as matrix products along time axis,
+        # index s of look-ahead arrays corresponds to time t-1+s
+        xs = self._x_filt_ahead[2:self.tau + 2]
+        xs_prev = self._x_filt_ahead[1:self.tau + 1]
+        res1 = self.V_pair[t + 1:t + self.tau + 1].sum(axis = 0, dtype = self.dtype) \
+            + xs.T @ xs_prev - self._b2[t:t + self.tau].T @ xs_prev
+        res2 = self._V_filt_ahead[1:self.tau + 1].sum(axis = 0) + xs_prev.T @ xs_prev
 
         F_est = res1 @ self.xp.linalg.pinv(res2)
 
         # update transition matrix
-        self.F = self.F - self.eta * self.xp.minimum(self.xp.maximum(-self.cutoff, self.F - F_est),
-                                                    self.cutoff)
+        self._update_parameter(self.F, F_est, self.eta, self.cutoff)
         if self.store_transition_matrices_on:
             self.Fs[t//self.tau+1] = self.F
 
@@ -436,43 +1017,73 @@ class ExpectationMaximizationKalmanFilter(object) :
             s {int} : last time for fixed-interval smoothing
 
         Attributes:
-            A [n_dim_sys, n_dim_sys] {numpy-array, float}
-                : fixed interval smoothed gain
+            As [tau, n_dim_sys, n_dim_sys] {numpy-array, float}
+                : fixed interval smoothed gains
         """
         if F is None:
-            F = _last_dims(self.F, t - 1, 2)
-
-        # pairwise covariance
-        A = self.xp.zeros((self.n_dim_sys, self.n_dim_sys), dtype = self.dtype)
-
-        self.x_smooth[s] = self.x_filt[s].copy()
-        self.V_smooth[s] = self.V_filt[s].copy()
+            F3 = self._F3
+        else:
+            F3 = _broadcast_time_axis(F, len(self.y), 2, self.use_gpu)
+
+        self.x_smooth[s] = self.x_filt[s]
+        self.V_smooth[s] = self.V_filt[s]
+
+        if self.use_jax:
+            if tau > 0:
+                _, backward_scan = _get_jax_scans()
+                results = backward_scan(*[X.astype(self.dtype, copy = False) for X in (
+                    self.x_smooth[s], self.V_smooth[s], F3[s-tau:s],
+                    self.x_filt[s-tau:s], self.V_filt[s-tau:s],
+                    self.x_pred[s-tau+1:s+1], self.V_pred[s-tau+1:s+1])],
+                    invert = self.invert)
+                for array, result in zip((self.x_smooth[s-tau:s],
+                        self.V_smooth[s-tau:s], self.V_pair[s-tau+1:s+1]), results):
+                    array[...] = np.asarray(result)
+            return
+
+        # fixed interval smoothing gains for t in [s-tau, s-1] do not depend
+        # on smoothed values, so they are calculated by one batched solve
+        As = self._solve(self.V_pred[s-tau+1:s+1],
+            (self.V_filt[s-tau:s] @ F3[s-tau:s]).transpose(0, 2, 1)
+            ).transpose(0, 2, 1).astype(self.dtype, copy = False)
 
         # t in [s-tau, s-1]
         for t in reversed(range(s-tau, s)) :
-            # visualize calculating time
-            print("\r expectation step calculating... t={}".format(s - t)
-                 + "/" + str(tau), end="")
-
-            # calculate fixed interval smoothing gain
-            A = self.V_filt[t] @ F @ self.xp.linalg.pinv(self.V_pred[t + 1])
-            
-            # fixed interval smoothing
-            self.x_smooth[t] = self.x_filt[t] \
-                + A @ (self.x_smooth[t + 1] - self.x_pred[t + 1])
-            self.V_smooth[t] = self.V_filt[t] \
-                + A @ (self.V_smooth[t + 1] - self.V_pred[t + 1]) @ A.T
-
-            # calculate pairwise covariance
-            self.V_pair[t + 1] = self.V_smooth[t + 1] @ A.T
+            A = As[t - s + tau]
+            if self.use_gpu:
+                # fixed interval smoothing
+                dx = self.xp.subtract(self.x_smooth[t + 1], self.x_pred[t + 1],
+                    out = self._dx_buf)
+                x = self.xp.matmul(A, dx, out = self._x_buf)
+                x += self.x_filt[t]
+                self.x_smooth[t] = x
+                D = self.xp.subtract(self.V_smooth[t + 1], self.V_pred[t + 1],
+                    out = self._W_buf)
+                AD = self.xp.matmul(A, D, out = self._FV_buf)
+                V = self.xp.matmul(AD, A.T, out = self._V_buf)
+                V += self.V_filt[t]
+                self.V_smooth[t] = self._symmetrize(V)
+
+                # calculate pairwise covariance
+                self.V_pair[t + 1] = self.xp.matmul(self.V_smooth[t + 1], A.T,
+                    out = self._FV_buf)
+            else:
+                # cast stored values only when they are not in calculation dtype
+                _kf_backward_step(A, *[X.astype(self.dtype, copy = False) for X in (
+                    self.x_filt[t], self.V_filt[t], self.x_pred[t + 1],
+                    self.V_pred[t + 1], self.x_smooth[t + 1], self.V_smooth[t + 1])],
+                    self.x_smooth[t], self.V_smooth[t], self.V_pair[t + 1],
+                    self._dx_buf, self._x_buf, self._W_buf, self._FV_buf,
+                    self._V_buf)
 
 
 
-    def get_predicted_value(self, dim = None):
+    def get_predicted_value(self, dim = None, as_numpy = False):
         """Get predicted value
 
         Args:
             dim {int} : dimensionality for extract from predicted result
+            as_numpy {bool} : if True, return numpy-array even when using gpu
 
         Returns (numpy-array, float)
             : mean of hidden state at time t given observations
@@ -485,19 +1096,20 @@ class ExpectationMaximizationKalmanFilter(object) :
             self.forward()
 
         if dim is None:
-            return self.x_pred
+            return self._output(self.x_pred, as_numpy)
         elif dim <= self.x_pred.shape[1]:
-            return self.x_pred[:, int(dim)]
+            return self._output(self.x_pred[:, int(dim)], as_numpy)
         else:
             raise ValueError('The dim must be less than '
                  + self.x_pred.shape[1] + '.')
 
 
-    def get_filtered_value(self, dim = None):
+    def get_filtered_value(self, dim = None, as_numpy = False):
         """Get filtered value
 
         Args:
             dim {int} : dimensionality for extract from filtered result
+            as_numpy {bool} : if True, return numpy-array even when using gpu
 
         Returns (numpy-array, float)
             : mean of hidden state at time t given observations
@@ -510,37 +1122,47 @@ class ExpectationMaximizationKalmanFilter(object) :
             self.forward()
 
         if dim is None:
-            return self.x_filt
+            return self._output(self.x_filt, as_numpy)
         elif dim <= self.x_filt.shape[1]:
-            return self.x_filt[:, int(dim)]
+            return self._output(self.x_filt[:, int(dim)], as_numpy)
         else:
             raise ValueError('The dim must be less than '
                  + self.x_filt.shape[1] + '.')
 
 
-    def get_transition_matrices(self, ids = None):
+    def get_transition_matrices(self, ids = None, as_numpy = False):
         """Get transition matrices
         
         Args:
             ids {numpy-array, int} : ids of transition matrices
+            as_numpy {bool} : if True, return numpy-array even when using gpu
 
         Returns {numpy-array, float}:
             : transition matrices
         """
         if self.store_transition_matrices_on:
             if ids is None:
-                return self.Fs
+                return self._output(self.Fs, as_numpy)
             else:
-                return self.Fs[ids]
+                return self._output(self.Fs[ids], as_numpy)
+        else:
+            return self._output(self.F, as_numpy)
+
+
+    def _output(self, X, as_numpy = False):
+        """Convert result to numpy-array if `as_numpy`"""
+        if as_numpy:
+            return self._asnumpy(X)
         else:
-            return self.F
+            return X
 
             
-    def get_smoothed_value(self, dim = None):
+    def get_smoothed_value(self, dim = None, as_numpy = False):
         """Get RTS smoothed value
 
         Args:
             dim {int} : dimensionality for extract from RTS smoothed result
+            as_numpy {bool} : if True, return numpy-array even when using gpu
 
         Returns (numpy-array, float)
             : mean of hidden state at time t given observations
@@ -553,9 +1175,9 @@ class ExpectationMaximizationKalmanFilter(object) :
             self.smooth()
 
         if dim is None:
-            return self.x_smooth
+            return self._output(self.x_smooth, as_numpy)
         elif dim <= self.x_smooth.shape[1]:
-            return self.x_smooth[:, int(dim)]
+            return self._output(self.x_smooth[:, int(dim)], as_numpy)
         else:
             raise ValueError('The dim must be less than '
                  + self.x_smooth.shape[1] + '.')
@@ -1,5 +1,57 @@
 import numpy as np
 import math
+from numba import njit
+
+
+# right-hand sides of the ODEs for a batch of states x [n_batch, n_dim].
+# these are jitted for numpy, and the same code runs on cupy through `py_func`.
+@njit(cache=True)
+def damped_oscillation_rhs(x, m, k, r, w, out):
+    out[:, 0] = x[:, 1]
+    out[:, 1] = (- k * x[:, 0] - r * x[:, 1] + w) / m
+
+
+@njit(cache=True)
+def duffing_rhs(x, m, alpha, beta, out):
+    out[:, 0] = x[:, 1]
+    out[:, 1] = (- alpha * x[:, 0] - beta * x[:, 0]**3) / m
+
+
+@njit(cache=True)
+def lorentz63_rhs(x, sigma, rho, beta, out):
+    out[:, 0] = sigma * (x[:, 1] - x[:, 0])
+    out[:, 1] = x[:, 0] * (rho - x[:, 2]) - x[:, 1]
+    out[:, 2] = x[:, 0] * x[:, 1] - beta * x[:, 2]
+
+
+@njit(cache=True)
+def vanderpol_rhs(x, mu, out):
+    out[:, 0] = x[:, 1]
+    out[:, 1] = mu * (1 - x[:, 0]**2) * x[:, 1] - x[:, 0]
+
+
+@njit(cache=True)
+def fitzhugh_nagumo_rhs(x, a, b, c, I, out):
+    out[:, 0] = c * (x[:, 0] - x[:, 1] - x[:, 0]**3 / 3 + I)
+    out[:, 1] = a + x[:, 0] - b * x[:, 1]
+
+
+@njit(cache=True)
+def lotka_volterra_rhs(x, a, b, c, d, out):
+    out[:, 0] = a * x[:, 0] - b * x[:, 0] * x[:, 1]
+    out[:, 1] = c * x[:, 0] * x[:, 1] - d * x[:, 1]
+
+
+@njit(cache=True)
+def clock_reaction_rhs(x, k1, k2, out):
+    #x0:A, x1:B, x2:T, x3:L
+    r1 = k1 * x[:, 0] * x[:, 1]
+    r2 = k2 * x[:, 2] * x[:, 3]
+    out[:, 0] = - r1
+    out[:, 1] = - r1
+    out[:, 2] = r1 - r2
+    out[:, 3] = - r2
+
 
 class ODE(object):
     def __init__(self, xp_type="numpy"):
@@ -9,10 +61,29 @@ class ODE(object):
             import cupy
             self.xp = cupy
 
-    def f(self, x, t):
+    def f(self, x, t, out=None):
+        """Calculate time derivative of state x at time t.
+        x is a state [n_dim] or a batch of states [n_batch, n_dim].
+        If out is given, the result is written into it; out must be
+        C-contiguous and must not share memory with x.
+        """
         pass
 
 
+    def _evaluate(self, rhs, x, out, *params):
+        """Evaluate right-hand side function `rhs` for state(s) x"""
+        if out is None:
+            out = self.xp.empty(x.shape, dtype = x.dtype)
+        elif not out.flags.c_contiguous:
+            raise ValueError("out must be C-contiguous.")
+        if self.xp is not np:
+            rhs = rhs.py_func
+        n_dim = x.shape[-1]
+        rhs(self.xp.ascontiguousarray(x).reshape(-1, n_dim), *params,
+            out.reshape(-1, n_dim))
+        return out
+
+
 class DampedOscillationModel(ODE):
     def __init__(self, m, k, r, w, xp_type="numpy"):
         super(DampedOscillationModel, self).__init__(xp_type)
@@ -22,11 +93,8 @@ class DampedOscillationModel(ODE):
         self.w = w
 
 
-    def f(self, x, t):
-        perturbation = self.xp.zeros_like(x)
-        perturbation[0] = x[1]
-        perturbation[1] = (- self.k * x[0] - self.r * x[1] + self.w(t)) / self.m
-        return perturbation
+    def f(self, x, t, out=None):
+        return self._evaluate(damped_oscillation_rhs, x, out, self.m, self.k, self.r, self.w(t))
 
 
 class CoefficientChangedDampedOscillationModel(ODE):
@@ -38,11 +106,8 @@ class CoefficientChangedDampedOscillationModel(ODE):
         self.w = w
 
 
-    def f(self, x, t):
-        perturbation = self.xp.zeros_like(x)
-        perturbation[0] = x[1]
-        perturbation[1] = (- self.k(t) * x[0] - self.r(t) * x[1] + self.w(t)) / self.m
-        return perturbation
+    def f(self, x, t, out=None):
+        return self._evaluate(damped_oscillation_rhs, x, out, self.m, self.k(t), self.r(t), self.w(t))
 
 
 class DuffingModel(ODE):
@@ -53,11 +118,8 @@ class DuffingModel(ODE):
         self.beta = beta
 
 
-    def f(self, x, t):
-        perturbation = self.xp.zeros_like(x)
-        perturbation[0] = x[1]
-        perturbation[1] = (- self.alpha * x[0] - self.beta * x[0]**3) / self.m
-        return perturbation
+    def f(self, x, t, out=None):
+        return self._evaluate(duffing_rhs, x, out, self.m, self.alpha, self.beta)
 
 
 class Lorentz63Model(ODE):
@@ -67,12 +129,8 @@ class Lorentz63Model(ODE):
         self.rho = rho
         self.beta = beta
 
-    def f(self, x, t):
-        perturbation = self.xp.zeros_like(x)
-        perturbation[0] = self.sigma * (x[1] - x[0])
-        perturbation[1] = x[0] * (self.rho - x[2]) - x[1]
-        perturbation[2] = x[0] * x[1] - self.beta * x[2]
-        return perturbation
+    def f(self, x, t, out=None):
+        return self._evaluate(lorentz63_rhs, x, out, self.sigma, self.rho, self.beta)
 
 
 class VanderPol(ODE):
@@ -80,11 +138,8 @@ class VanderPol(ODE):
         super(VanderPol, self).__init__(xp_type)
         self.mu = mu
 
-    def f(self, x, t):
-        perturbation = self.xp.zeros_like(x)
-        perturbation[0] = x[1]
-        perturbation[1] = self.mu * (1 - x[0]**2) * v - x[0]
-        return perturbation
+    def f(self, x, t, out=None):
+        return self._evaluate(vanderpol_rhs, x, out, self.mu)
 
 
 class FitzHughNagumo(ODE):
@@ -95,11 +150,8 @@ class FitzHughNagumo(ODE):
         self.c = c
         self.I = I
 
-    def f(self, x, t):
-        perturbation = self.xp.zeros_like(x)
-        perturbation[0] = self.c * (x[0] - x[1] - x[0]**3 / 3 + self.I(t))
-        perturbation[1] = self.a + x[0] - self.b * x[1]
-        return perturbation
+    def f(self, x, t, out=None):
+        return self._evaluate(fitzhugh_nagumo_rhs, x, out, self.a, self.b, self.c, self.I(t))
 
 
 class LotkaVolterra(ODE):
@@ -110,11 +162,8 @@ class LotkaVolterra(ODE):
         self.c = c
         self.d = d
 
-    def f(self, x, t):
-        perturbation = self.xp.zeros_like(x)
-        perturbation[0] = self.a * x[0] - self.b * x[0] * x[1]
-        perturbation[1] = self.c * x[0] * x[1] - self.d * x[1]
-        return perturbation
+    def f(self, x, t, out=None):
+        return self._evaluate(lotka_volterra_rhs, x, out, self.a, self.b, self.c, self.d)
 
 
 class ClockReaction(ODE):
@@ -123,45 +172,43 @@ class ClockReaction(ODE):
         self.k1 = k1
         self.k2 = k2
 
-    def f(self, x, t):
-        #x0:A, x1:B, x2:T, x3:L
-        perturbation = self.xp.zeros_like(x)
-        perturbation[0] = - self.k1 * x[0] * x[1]
-        perturbation[1] = - self.k1 * x[0] * x[1]
-        perturbation[2] = self.k1 * x[0] * x[1] - self.k2 * x[2] * x[3]
-        perturbation[3] = - self.k2 * x[2] * x[3]
-        return perturbation
+    def f(self, x, t, out=None):
+        return self._evaluate(clock_reaction_rhs, x, out, self.k1, self.k2)
         
 
 
+@njit(cache=True)
+def _rotation_matrix_3d(theta):
+    # Rz @ Ry @ Rx written out in closed form
+    cx, sx = math.cos(theta[0]), math.sin(theta[0])
+    cy, sy = math.cos(theta[1]), math.sin(theta[1])
+    cz, sz = math.cos(theta[2]), math.sin(theta[2])
+    return np.array([[cz*cy, -cz*sy*sx - sz*cx, -cz*sy*cx + sz*sx],
+                     [sz*cy, -sz*sy*sx + cz*cx, -sz*sy*cx - cz*sx],
+                     [sy, cy*sx, cy*cx]])
+
+
 def rotation_matrix_3d(theta):
-    result = self.xp.eye(3)
-    R = self.xp.array([[1, 0, 0],
-                  [0, math.cos(theta[0]), -math.sin(theta[0])],
-                  [0, math.sin(theta[0]), math.cos(theta[0])]])
-    result = R @ result
-    R = self.xp.array([[math.cos(theta[1]), 0, -math.sin(theta[1])],
-                  [0, 1, 0],
-                  [math.sin(theta[1]), 0, math.cos(theta[1])]])
-    result = R @ result
-    R = self.xp.array([[math.cos(theta[2]), -math.sin(theta[2]), 0],
-                  [math.sin(theta[2]), math.cos(theta[2]), 0],
-                  [0, 0, 1]])
-    return R @ result
+    # cast here so that lists and integer arrays reach the jitted core as float64
+    return _rotation_matrix_3d(np.asarray(theta, dtype=np.float64))
 
 
-def Rodrigues_rotation_matrix(n, theta):
-    if self.xp.linalg.norm(n)!=0:
-        n = n / self.xp.linalg.norm(n) 
+@njit(cache=True)
+def _Rodrigues_rotation_matrix(n, theta):
+    norm = np.linalg.norm(n)
+    if norm!=0:
+        u = n / norm
     else:
         raise ValueError("norm of n must be greater than 0.")
 
-    return self.xp.array([[math.cos(theta)+n[0]*n[0]*(1-math.cos(theta)),
-                        n[0]*n[1]*(1-math.cos(theta))-n[2]*math.sin(theta),
-                        n[0]*n[2]*(1-math.cos(theta))+n[1]*math.sin(theta)],
-                     [n[0]*n[1]*(1-math.cos(theta))+n[2]*math.sin(theta),
-                        math.cos(theta)+n[1]*n[1]*(1-math.cos(theta)),
-                        n[1]*n[2]*(1-math.cos(theta))-n[0]*math.sin(theta)],
-                     [n[0]*n[2]*(1-math.cos(theta))-n[1]*math.sin(theta),
-                        n[1]*n[2]*(1-math.cos(theta))+n[0]*math.sin(theta),
-                        math.cos(theta)+n[2]*n[2]*(1-math.cos(theta))]])
+    c = math.cos(theta)
+    s = math.sin(theta)
+    C = 1 - c
+    return np.array([[c + u[0]*u[0]*C, u[0]*u[1]*C - u[2]*s, u[0]*u[2]*C + u[1]*s],
+                     [u[0]*u[1]*C + u[2]*s, c + u[1]*u[1]*C, u[1]*u[2]*C - u[0]*s],
+                     [u[0]*u[2]*C - u[1]*s, u[1]*u[2]*C + u[0]*s, c + u[2]*u[2]*C]])
+
+
+def Rodrigues_rotation_matrix(n, theta):
+    # cast here so that lists and integer arrays reach the jitted core as float64
+    return _Rodrigues_rotation_matrix(np.asarray(n, dtype=np.float64), float(theta))
@@ -105,6 +105,33 @@ def _last_dims(X, t, ndims = 2, xp_type="numpy"):
                 " or more are required") % (len(X.shape), ndims))
 
 
+def _broadcast_time_axis(X, T, ndims = 2, xp_type="numpy"):
+    """Broadcast `X` along the time axis
+    Return `X` itself if `X` has `ndims` + 1 dimensions, otherwise return
+    a read-only view of `X` repeated `T` times along a new first axis.
+    Parameters
+    ----------
+    X : array with dimension `ndims` or `ndims` + 1
+    T : int
+        length of the time axis
+    ndims : int, optional
+        number of dimensions of `X` for each time
+
+    Returns
+    -------
+    Y : array with dimension `ndims` + 1
+        `X` indexable by time as `Y[t]`
+    """
+    xp = judge_xp_type(xp_type)
+    if X.ndim == ndims + 1:
+        return X
+    elif X.ndim == ndims:
+        return xp.broadcast_to(X, (T,) + X.shape)
+    else:
+        raise ValueError(("X only has %d dimensions when %d" +
+                " or more are required") % (X.ndim, ndims))
+
+
 # calculate transition covariance
 def _calc_transition_covariance(self, G, Q):
     """Calculate transition covariance